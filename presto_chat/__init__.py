@@ -0,0 +1 @@
+"""Presto Knowledge AI Copilot 공용 모듈."""
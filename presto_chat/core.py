@@ -0,0 +1,220 @@
+"""
+Presto 챗봇 공용 로직: Gemini 클라이언트, File Search Store 조회, 질문(스트리밍 + 재시도).
+UI(app_streamlit.py)는 이 모듈만 import 해서 사용한다.
+"""
+import streamlit as st
+from google import genai
+from google.genai import types, errors
+import time
+import os
+import functools
+import random
+import threading
+from typing import Iterator
+
+# ==== 클라이언트 & 스토어 ====
+@st.cache_resource
+def get_client():
+    return genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+
+
+@st.cache_resource
+def _stores_by_name() -> dict:
+    """전체 Store 목록을 한 번만 조회해서 display_name → Store 딕셔너리로 캐시"""
+    client = get_client()
+    return {getattr(s, "display_name", None): s for s in client.file_search_stores.list()}
+
+
+@st.cache_resource
+def get_store(display_name: str):
+    """
+    display_name으로 Store를 찾고 없으면 새로 생성.
+    (이미 만들어둔 presto_* 스토어도 display_name 기준으로 잘 찾아옵니다.)
+    """
+    stores = _stores_by_name()
+    store = stores.get(display_name)
+    if store is not None:
+        return store
+
+    # 없으면 생성 (예외 케이스용) 후 캐시된 딕셔너리에도 등록
+    store = get_client().file_search_stores.create(
+        config={"display_name": display_name}
+    )
+    stores[display_name] = store
+    return store
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def store_name_for(display_name: str) -> str:
+    """display_name에 해당하는 Store의 리소스 이름(store.name)만 캐시해서 반환"""
+    return get_store(display_name).name
+
+
+def _warm_up():
+    try:
+        _stores_by_name()
+    except Exception as e:
+        # 실패해도 첫 요청에서 다시 조회하므로 로그만 남긴다.
+        print("[warm_up 실패]", e)
+
+
+@st.cache_resource(show_spinner=False)
+def start_warm_up() -> threading.Thread:
+    """
+    클라이언트와 Store 목록을 백그라운드 스레드에서 미리 불러온다 (프로세스당 1회).
+    둘 다 st.cache_resource로 캐시되므로 이후 호출은 데워진 값을 바로 가져간다.
+    """
+    thread = threading.Thread(target=_warm_up, daemon=True)
+    thread.start()
+    return thread
+
+
+DOCUMENTS_TTL = 600  # 초, 문서 목록 캐시 유지 시간
+
+
+def iter_document_labels(store_name: str) -> Iterator[str]:
+    """특정 File Search Store 안의 문서 표시 이름을 API 페이지가 도착하는 대로 하나씩 yield"""
+    client = get_client()
+    for d in client.file_search_stores.documents.list(parent=store_name):
+        yield getattr(d, "display_name", None) or getattr(d, "name", "(no name)")
+
+
+@st.cache_resource
+def _documents_by_store() -> dict:
+    """store_name → (조회 시각, 문서 표시 이름 튜플) 캐시"""
+    return {}
+
+
+def list_documents(store_name: str) -> Iterator[str]:
+    """
+    특정 File Search Store 안에 들어있는 문서 리스트 조회 (10분 캐시).
+    캐시가 유효하면 저장된 튜플을 그대로 내보내고, 아니면 API에서 받아오는 대로 yield 하면서
+    끝까지 받은 목록만 튜플로 캐시한다. (SDK 객체는 캐시에 담지 않음)
+    """
+    cache = _documents_by_store()
+    entry = cache.get(store_name)
+    if entry is not None and time.monotonic() - entry[0] < DOCUMENTS_TTL:
+        yield from entry[1]
+        return
+
+    labels = []
+    for label in iter_document_labels(store_name):
+        labels.append(label)
+        yield label
+    cache[store_name] = (time.monotonic(), tuple(labels))
+
+
+_SYSTEM_INSTRUCTION = (
+    "당신은 제공된 문서를 기반으로 답변하는 AI 어시스턴트입니다.\n"
+    "다음 규칙을 반드시 준수하세요:\n"
+    "1. 오직 제공된 문서(Context)에 있는 내용만 사용하여 답변하세요.\n"
+    "2. 문서에 없는 내용은 '문서에 해당 내용이 없습니다'라고 답변하고, 외부 지식을 사용하지 마세요.\n"
+    "3. 답변의 끝에는 반드시 참고한 문서의 이름(Source)을 명시하세요.\n"
+    "   예시: (출처: 파일명.pdf)\n"
+    "4. 답변은 반드시 한국어로 작성하세요."
+)
+
+
+@functools.lru_cache(maxsize=8)
+def _config_for(store_name: str, model_name: str) -> types.GenerateContentConfig:
+    """Store별 GenerateContentConfig를 한 번만 만들어 재사용 (요청/재시도마다 새로 만들지 않음)"""
+    return types.GenerateContentConfig(
+        system_instruction=_SYSTEM_INSTRUCTION,
+        tools=[
+            types.Tool(
+                file_search=types.FileSearch(
+                    file_search_store_names=[store_name]
+                )
+            )
+        ]
+    )
+
+
+RETRYABLE_SERVER_CODES = (502, 503, 504)
+BACKOFF_BASE = 1.0  # 초
+BACKOFF_CAP = 30.0  # 초
+
+
+def _backoff_delay(attempt: int) -> float:
+    """지수 백오프 + full jitter: [0, min(cap, base * 2^(attempt-1))] 사이 임의 대기 시간"""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** (attempt - 1))))
+
+
+def _retry_delay_from(e: errors.APIError) -> float | None:
+    """
+    429 응답에 포함된 google.rpc.RetryInfo의 retryDelay(예: "12s")를 초 단위로 반환.
+    없거나 파싱할 수 없으면 None.
+    """
+    payload = getattr(e, "details", None)
+    if isinstance(payload, dict):
+        payload = payload.get("error", payload)
+        details = payload.get("details") or []
+    else:
+        details = []
+
+    for d in details:
+        if not isinstance(d, dict):
+            continue
+        if str(d.get("@type", "")).endswith("RetryInfo") and "retryDelay" in d:
+            try:
+                return float(str(d["retryDelay"]).rstrip("s"))
+            except ValueError:
+                return None
+    return None
+
+
+def ask_question_stream(
+    store_name: str,
+    history: list[types.Content],
+    model_name: str,
+) -> Iterator[str]:
+    """
+    File Search가 연결된 Gemini에게 질문 (스트리밍 + 재시도 로직 포함).
+    청크가 도착할 때마다 지금까지 누적된 답변 전체를 yield 한다.
+    (재시도로 스트림이 다시 시작되면 누적 텍스트도 처음부터 다시 쌓인다.)
+    """
+    client = get_client()
+    max_retries = 5
+
+    for attempt in range(1, max_retries + 1):
+        try:
+            stream = client.models.generate_content_stream(
+                model=model_name,
+                contents=history,
+                config=_config_for(store_name, model_name),
+            )
+            buf = ""
+            for chunk in stream:
+                buf += chunk.text or ""
+                yield buf
+            return
+
+        except errors.ServerError as e:
+            # 502/503/504 같은 일시적인 서버 에러만 재시도
+            retryable = e.code in RETRYABLE_SERVER_CODES or "overloaded" in str(e)
+            if retryable and attempt < max_retries:
+                sleep_for = _backoff_delay(attempt)
+                print(
+                    f"[ServerError] {e.code}, {attempt}회 시도 실패 → {sleep_for:.1f}초 후 재시도"
+                )
+                time.sleep(sleep_for)
+                continue
+
+            st.error("현재 Gemini 서버가 과부하 상태입니다. 잠시 후 다시 시도해 주세요.")
+            print("[ServerError 최종 실패]", e)
+            return
+
+        except errors.APIError as e:
+            # 429(요청 한도 초과)는 재시도, 그 외 4xx 검증 에러는 바로 실패
+            if e.code == 429 and attempt < max_retries:
+                # 서버가 알려준 retryDelay가 있으면 우선, jitter 값은 최소 대기 시간으로 사용
+                sleep_for = max(_retry_delay_from(e) or 0.0, _backoff_delay(attempt))
+                print(
+                    f"[APIError] 429, {attempt}회 시도 실패 → {sleep_for:.1f}초 후 재시도"
+                )
+                time.sleep(sleep_for)
+                continue
+
+            st.error(f"Gemini API 에러 발생: {e}")
+            print("[APIError]", e)
+            return